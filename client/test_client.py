@@ -5,8 +5,10 @@ from litellm.experimental_mcp_client.tools import (
     transform_mcp_tool_to_openai_tool,
     transform_openai_tool_call_request_to_mcp_tool_call_request,
 )
-import json
+from typing import Dict, Tuple
+import orjson
 import asyncio
+import copy
 import uuid
 
 ROUTER_CONFIG = [{
@@ -46,6 +48,10 @@ def code_execution_parser(tool_result: CallToolResult):
             output_str += f"{kernel_output['mime_type']}:\n{kernel_output['content']}\n"
     return output_str
 
+# Transformed tool catalog and system prompt, shared by agents using the same servers
+_TOOL_CACHE: Dict[Tuple[str, ...], Tuple[list, str]] = {}
+_TOOL_CACHE_LOCK = asyncio.Lock()
+
 TOOL_RESULT_PARSERS = {
     "code_sandbox_server": {
         "execute_code": code_execution_parser
@@ -56,6 +62,11 @@ class SimpleAgent:
 
     def __init__(self, router: Router):
         self.id = str(uuid.uuid4())
+        self.tool_cache_key = tuple(sorted(
+            server_config["url"]
+            for server_config in MCP_SERVER_CONFIG["mcpServers"].values()
+            if "url" in server_config
+        ))
         self.client = Client(self.add_context_id_to_server_config(MCP_SERVER_CONFIG))
         self.router = router
         self.llm_model = "gpt-5-nano"
@@ -65,8 +76,8 @@ class SimpleAgent:
 
     def get_tool_parsers(self, parsers_dict: dict):
         tool_parsers = {}
-        for server_name, tool_parsers in parsers_dict.items():
-            for tool_name, parser in tool_parsers.items():
+        for server_name, server_parsers in parsers_dict.items():
+            for tool_name, parser in server_parsers.items():
                 if len(parsers_dict) > 1:
                     tool_parsers[f"{server_name}_{tool_name}"] = parser
                 else:
@@ -76,6 +87,8 @@ class SimpleAgent:
     
 
     def add_context_id_to_server_config(self, mcp_config: dict):
+        # copy so the shared config keeps its base URLs for other agents
+        mcp_config = copy.deepcopy(mcp_config)
         mcp_servers = mcp_config["mcpServers"]
         for server_name, server_config in mcp_servers.items():
             if "url" in server_config:
@@ -85,19 +98,38 @@ class SimpleAgent:
         return mcp_config
 
 
-    async def setup(self):
-        self.mcp_tools = await self.client.list_tools()
+    async def load_tools(self):
+        mcp_tools = await self.client.list_tools()
         print("MCP Tools:")
-        print(json.dumps([tool.model_dump() for tool in self.mcp_tools], indent=4))
+        print(orjson.dumps([tool.model_dump() for tool in mcp_tools], option=orjson.OPT_INDENT_2).decode())
 
-        self.openai_tools = [transform_mcp_tool_to_openai_tool(tool) for tool in self.mcp_tools]
+        openai_tools = [transform_mcp_tool_to_openai_tool(tool) for tool in mcp_tools]
+        # the tool catalog does not change between turns, serialize it once
+        openai_tools_serialized = orjson.dumps(openai_tools, option=orjson.OPT_INDENT_2).decode()
         print("OpenAI Tools:")
-        print(json.dumps(self.openai_tools, indent=4))
+        print(openai_tools_serialized)
+
+        return openai_tools, SYSTEM_PROMPT.format(mcp_tools=openai_tools_serialized)
 
-        system_prompt = SYSTEM_PROMPT.format(mcp_tools=json.dumps(self.openai_tools, indent=4))
+
+    async def setup(self):
+        # the lock makes concurrent setups share a single list_tools request
+        async with _TOOL_CACHE_LOCK:
+            if self.tool_cache_key not in _TOOL_CACHE:
+                _TOOL_CACHE[self.tool_cache_key] = await self.load_tools()
+        openai_tools, system_prompt = _TOOL_CACHE[self.tool_cache_key]
+        self.openai_tools = list(openai_tools)
         self.messages.append({"role": "system", "content": system_prompt})
 
 
+    async def refresh_tools(self):
+        async with _TOOL_CACHE_LOCK:
+            _TOOL_CACHE[self.tool_cache_key] = await self.load_tools()
+        openai_tools, system_prompt = _TOOL_CACHE[self.tool_cache_key]
+        self.openai_tools = list(openai_tools)
+        self.messages[0] = {"role": "system", "content": system_prompt}
+
+
     def get_llm_response(self):
         kwargs = {
             "tools": self.openai_tools,
@@ -121,6 +153,18 @@ class SimpleAgent:
             return tool_result.content
 
 
+    async def call_tool(self, tool_call_id: str, mcp_tool_call):
+        try:
+            tool_result = await self.client.call_tool(
+                name=mcp_tool_call.name,
+                arguments=mcp_tool_call.arguments
+            )
+        except Exception as e:
+            print(f"Tool call failed: {str(e)}")
+            return tool_call_id, f"Tool call failed: {str(e)}"
+        return tool_call_id, self.parse_tool_result(mcp_tool_call.name, tool_result)
+
+
     async def run(self):
         async with self.client:
             await self.setup()
@@ -135,27 +179,28 @@ class SimpleAgent:
                 print(response)
                 self.messages.append(response)
                 if response.tool_calls:
-                    for tool_call in response.tool_calls:
-                        mcp_tool_call = transform_openai_tool_call_request_to_mcp_tool_call_request(
+                    mcp_tool_calls = [
+                        transform_openai_tool_call_request_to_mcp_tool_call_request(
                             openai_tool=tool_call.model_dump()
                         )
-                        tool_call_id = tool_call.id
-                        tool_name = mcp_tool_call.name
-                        tool_args = mcp_tool_call.arguments
-                        try:
-                            tool_result = await self.client.call_tool(
-                                name=tool_name, 
-                                arguments=tool_args
-                            )
-                        except Exception as e:
-                            print(f"Tool call failed: {str(e)}")
-                            break
-                        tool_result = self.parse_tool_result(tool_name, tool_result)
+                        for tool_call in response.tool_calls
+                    ]
+                    # submit every tool call first, then handle results as they arrive
+                    pending = [
+                        asyncio.create_task(self.call_tool(tool_call.id, mcp_tool_call))
+                        for tool_call, mcp_tool_call in zip(response.tool_calls, mcp_tool_calls)
+                    ]
+                    tool_results = {}
+                    for next_result in asyncio.as_completed(pending):
+                        tool_call_id, tool_result = await next_result
                         print(f"parsed tool result: {tool_result}")
+                        tool_results[tool_call_id] = tool_result
+                    # keep tool responses in the same order as the tool calls
+                    for tool_call in response.tool_calls:
                         self.messages.append({
                             "role": "tool",
-                            "content": tool_result,
-                            "tool_call_id": tool_call_id
+                            "content": tool_results[tool_call.id],
+                            "tool_call_id": tool_call.id
                         })
     
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from enum import Enum
 
 
@@ -7,6 +7,8 @@ class Language(Enum):
     BASH = "bash"
 
 class KernelOutput(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     mime_type: str
     content: str
     is_error: bool
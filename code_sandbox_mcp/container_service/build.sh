@@ -0,0 +1,22 @@
+#!/usr/bin/env sh
+# Build the container service image. When CODE_SANDBOX_IMAGE points at a registry
+# you control, layers from the last image pushed there are reused.
+set -e
+
+IMAGE="${CODE_SANDBOX_IMAGE:-code-sandbox-mcp/container-service:latest}"
+
+cd "$(dirname "$0")"
+
+# Only pull and reuse a cache image that was named explicitly
+set --
+if [ -n "$CODE_SANDBOX_IMAGE" ]; then
+    docker pull "$IMAGE" || true
+    set -- --cache-from "$IMAGE"
+fi
+
+DOCKER_BUILDKIT=1 docker build \
+    "$@" \
+    --build-arg BUILDKIT_INLINE_CACHE=1 \
+    --build-arg CONTAINER_SERVICE_PORT="${CONTAINER_SERVICE_PORT:-8060}" \
+    -t "$IMAGE" \
+    .
@@ -1,22 +1,18 @@
 KERNEL_LIBRARIES = \
     [
         {
-            "pip": "pandas", 
             "name": "pandas", 
             "alias": "pd"
         }, 
         {
-            "pip": "numpy", 
             "name": "numpy", 
             "alias": "np"
         }, 
         {
-            "pip": "matplotlib", 
             "name": "matplotlib.pyplot", 
             "alias": "plt"
         }, 
         {
-            "pip": "seaborn", 
             "name": "seaborn", 
             "alias": "sns"
         }
@@ -4,36 +4,60 @@ Runs in a Docker container and manages Jupyter kernels for code execution.
 """
 
 import asyncio
+import os
+import time
 import traceback
 import logging
-from typing import Dict, List, Any
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from jupyter_client.manager import AsyncKernelManager
+import anyio
+import orjson
 import uvicorn
 
 from jupyter_imports import KERNEL_LIBRARIES
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging, quiet by default since execution paths log per message
+LOG_LEVEL = os.getenv("LOG_LEVEL", "warning").lower()
+logging.basicConfig(level=LOG_LEVEL.upper())
 logger = logging.getLogger(__name__)
 
+# Number of started kernels kept ready for new kernel IDs
+WARM_KERNELS = int(os.getenv("WARM_KERNELS", "2"))
+# Least recently used kernels are shut down beyond this many
+MAX_KERNELS = int(os.getenv("MAX_KERNELS", "32"))
+# Kernels idle for longer than this are shut down
+KERNEL_TTL_SEC = float(os.getenv("KERNEL_TTL_SEC", "1800"))
+KERNEL_REAP_INTERVAL_SEC = 60
+
+
+def build_import_code(libraries: List[dict]) -> str:
+    """Build the cell that imports the default kernel libraries"""
+    lines = []
+    for library in libraries:
+        lines.append(f"import {library['name']} as {library['alias']}")
+        if "matplotlib" in library['name']:
+            lines.append("%matplotlib inline")
+    return "\n".join(lines)
+
+# The libraries are installed in the image, so the import cell never changes
+IMPORT_CODE = build_import_code(KERNEL_LIBRARIES)
+
 
 class ExecuteRequest(BaseModel):
     kernel_id: str
     code: str
     language: str  # "python" or "bash"
 
-class ExecuteResponse(BaseModel):
-    success: bool
-    messages: List[Dict[str, Any]]
-    error: str = None
-
 class JupyterKernel:
     def __init__(self):
         self.km = AsyncKernelManager()
         self.kc = None
         self._execution_lock = asyncio.Lock()
+        self.last_used = time.monotonic()
     
     async def start(self, working_dir: str = "/workspace"):
         logger.info(f"Starting Jupyter kernel in {working_dir}")
@@ -43,43 +67,73 @@ class JupyterKernel:
         self.kc.start_channels()
         await self.kc.wait_for_ready()
 
-    async def import_libraries(self, libraries: List[dict]):
-        code = ""
-        for library in libraries:
-            if "pip" in library:
-                code += f"!pip install {library['pip']}\n"
-            code += f"import {library['name']} as {library['alias']}\n"
-            if "matplotlib" in library['name']:
-                code += "%matplotlib inline\n"
-        
+    async def import_libraries(self):
         # Execute the import code and collect messages but don't return them
         messages = []
-        async for message in self.execute_raw(code):
+        async for message in self.execute_raw(IMPORT_CODE):
             messages.append(message)
-            logger.info(f"Import result: {message}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Import result: %s", message)
 
     async def execute_raw(self, code: str):
         """Execute code and return raw Jupyter messages"""
         async with self._execution_lock:
-            msg_id = self.kc.execute(code)
-            logger.info(f"Executing with msg_id: {msg_id}")
+            # Executions are already serialized by the lock, so a failed or interrupted
+            # cell must not make the kernel abort the request queued behind it
+            msg_id = self.kc.execute(code, stop_on_error=False)
+            logger.debug("Executing with msg_id: %s", msg_id)
+            idle = False
             
             try:
-                while True:
+                while not idle:
                     reply = await self.kc.get_iopub_msg()
+                    # Skip output left over from an earlier, abandoned execution
+                    if reply.get("parent_header", {}).get("msg_id") != msg_id:
+                        continue
                     msg_type = reply.get("msg_type")
-                    logger.info(f"Received message type: {msg_type}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("iopub %s", msg_type)
+                    
+                    # Stop after status idle
+                    idle = msg_type == "status" and reply["content"]["execution_state"] == "idle"
                     
                     # Return raw message
                     yield reply
-                    
-                    # Break on status idle
-                    if msg_type == "status" and reply["content"]["execution_state"] == "idle":
-                        break
-                        
-            except asyncio.CancelledError:
-                logger.info("Execution cancelled")
-                pass
+            
+            finally:
+                # The caller went away mid-cell (cancelled or closed the stream),
+                # so stop the cell before the next execution can take the kernel
+                if not idle:
+                    # Starlette cancels the stream through an anyio scope, which would
+                    # cancel these awaits too
+                    with anyio.CancelScope(shield=True):
+                        await self._stop_execution(msg_id)
+                # Count the end of a long cell as a use so the reaper measures idle time from here
+                self.last_used = time.monotonic()
+
+    async def _stop_execution(self, msg_id: str, timeout: float = 30):
+        """Interrupt an abandoned execution and discard the rest of its output"""
+        logger.info("Execution abandoned, interrupting kernel")
+        try:
+            await self.km.interrupt_kernel()
+            await asyncio.wait_for(self._drain(msg_id), timeout)
+        except Exception:
+            logger.error(f"Failed to stop abandoned execution: {traceback.format_exc()}")
+
+    async def _drain(self, msg_id: str):
+        while True:
+            reply = await self.kc.get_iopub_msg()
+            if (
+                reply.get("parent_header", {}).get("msg_id") == msg_id
+                and reply.get("msg_type") == "status"
+                and reply["content"]["execution_state"] == "idle"
+            ):
+                return
+
+    async def shutdown_when_idle(self):
+        """Shutdown once any running execution has finished"""
+        async with self._execution_lock:
+            await self.shutdown()
 
     async def shutdown(self):
         if self.kc:
@@ -89,25 +143,83 @@ class JupyterKernel:
 
 
 class KernelManager:
-    def __init__(self):
-        self.kernels: Dict[str, JupyterKernel] = {}
+    def __init__(self, max_kernels: int = MAX_KERNELS, kernel_ttl: float = KERNEL_TTL_SEC):
+        # Ordered from least to most recently used
+        self.kernels: "OrderedDict[str, JupyterKernel]" = OrderedDict()
+        self.max_kernels = max_kernels
+        self.kernel_ttl = kernel_ttl
         self._kernel_locks: Dict[str, asyncio.Lock] = {}
-        self._lock = asyncio.Lock()
+        self._warm_kernels: asyncio.Queue = asyncio.Queue()
+        self._warm_tasks: Set[asyncio.Task] = set()
+        self._eviction_tasks: Set[asyncio.Task] = set()
+        self._reaper_task: Optional[asyncio.Task] = None
+
+    async def _start_kernel(self) -> JupyterKernel:
+        kernel = JupyterKernel()
+        await kernel.start()
+        await kernel.import_libraries()
+        return kernel
+
+    async def _add_warm_kernel(self):
+        try:
+            kernel = await self._start_kernel()
+        except Exception:
+            logger.error(f"Failed to start warm kernel: {traceback.format_exc()}")
+            return
+        await self._warm_kernels.put(kernel)
+
+    def warm(self, n: int = WARM_KERNELS):
+        """Start kernels in the background so new kernel IDs skip start-up"""
+        for _ in range(n):
+            task = asyncio.create_task(self._add_warm_kernel())
+            self._warm_tasks.add(task)
+            task.add_done_callback(self._warm_tasks.discard)
 
     async def get_kernel(self, kernel_id: str) -> JupyterKernel:
-        async with self._lock:
-            if kernel_id not in self._kernel_locks:
-                self._kernel_locks[kernel_id] = asyncio.Lock()
-            lock = self._kernel_locks[kernel_id]
+        # setdefault is atomic on the event loop, so unrelated kernels never wait on each other
+        lock = self._kernel_locks.setdefault(kernel_id, asyncio.Lock())
         
         async with lock:
             if kernel_id not in self.kernels:
-                logger.info(f"Creating new kernel for ID: {kernel_id}")
-                kernel = JupyterKernel()
-                await kernel.start()
-                await kernel.import_libraries(KERNEL_LIBRARIES)
+                try:
+                    kernel = self._warm_kernels.get_nowait()
+                    logger.info(f"Assigning warm kernel to ID: {kernel_id}")
+                    # Replace the kernel we just took
+                    self.warm(1)
+                except asyncio.QueueEmpty:
+                    logger.info(f"Creating new kernel for ID: {kernel_id}")
+                    kernel = await self._start_kernel()
                 self.kernels[kernel_id] = kernel
-            return self.kernels[kernel_id]
+                while len(self.kernels) > self.max_kernels:
+                    self._evict(next(iter(self.kernels)))
+            else:
+                self.kernels.move_to_end(kernel_id)
+            kernel = self.kernels[kernel_id]
+            kernel.last_used = time.monotonic()
+            return kernel
+
+    def _evict(self, kernel_id: str):
+        logger.info(f"Evicting kernel for ID: {kernel_id}")
+        kernel = self.kernels.pop(kernel_id)
+        self._kernel_locks.pop(kernel_id, None)
+        task = asyncio.create_task(kernel.shutdown_when_idle())
+        self._eviction_tasks.add(task)
+        task.add_done_callback(self._eviction_tasks.discard)
+
+    async def _reap_idle_kernels(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.kernel_ttl
+            for kernel_id, kernel in list(self.kernels.items()):
+                # Finishing an execution also refreshes last_used without reordering,
+                # so the LRU order is not sorted by last_used and every kernel is checked
+                if kernel.last_used < cutoff and not kernel._execution_lock.locked():
+                    self._evict(kernel_id)
+
+    def start_reaper(self, interval: float = KERNEL_REAP_INTERVAL_SEC):
+        """Periodically shut down kernels idle for longer than the TTL"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_idle_kernels(interval))
 
     async def shutdown_kernel(self, kernel_id: str):
         if kernel_id in self.kernels:
@@ -117,6 +229,13 @@ class KernelManager:
                 del self._kernel_locks[kernel_id]
 
     async def shutdown_all(self):
+        if self._reaper_task:
+            self._reaper_task.cancel()
+        for task in list(self._warm_tasks):
+            task.cancel()
+        await asyncio.gather(*self._eviction_tasks, return_exceptions=True)
+        while not self._warm_kernels.empty():
+            await self._warm_kernels.get_nowait().shutdown()
         for kernel_id in list(self.kernels.keys()):
             await self.shutdown_kernel(kernel_id)
 
@@ -125,65 +244,50 @@ class KernelManager:
 kernel_manager = KernelManager()
 
 # FastAPI app
-app = FastAPI(title="Containerized Kernel Service")
+app = FastAPI(title="Containerized Kernel Service", default_response_class=ORJSONResponse)
 
-@app.post("/execute", response_model=ExecuteResponse)
+@app.post("/execute", response_model=None)
 async def execute_code(request: ExecuteRequest):
-    """Execute code in a Jupyter kernel or shell"""
+    """Execute code in a Jupyter kernel or shell, streaming messages as NDJSON"""
     logger.info(f"Executing {request.language} code for kernel {request.kernel_id}")
     
+    if request.language == "python":
+        code = request.code
+    elif request.language == "bash":
+        code = shell_to_jupyter_code(request.code)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported language: {request.language}")
+    
+    return StreamingResponse(
+        stream_execution(request.kernel_id, code),
+        media_type="application/x-ndjson"
+    )
+
+async def stream_execution(kernel_id: str, code: str):
+    """Yield raw Jupyter messages as NDJSON lines while the kernel produces them"""
     try:
-        if request.language == "python":
-            return await execute_python_code(request)
-        elif request.language == "bash":
-            return await execute_shell_code(request)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported language: {request.language}")
+        kernel = await kernel_manager.get_kernel(kernel_id)
+        async for message in kernel.execute_raw(code):
+            yield orjson.dumps(message, default=str) + b"\n"
     
     except Exception as e:
         logger.error(f"Error executing code: {traceback.format_exc()}")
-        return ExecuteResponse(
-            success=False,
-            messages=[],
-            error=str(traceback.format_exc())
-        )
-
-async def execute_python_code(request: ExecuteRequest) -> ExecuteResponse:
-    """Execute Python code in Jupyter kernel"""
-    kernel = await kernel_manager.get_kernel(request.kernel_id)
-    messages = []
-    
-    async for message in kernel.execute_raw(request.code):
-        messages.append(message)
-    
-    return ExecuteResponse(
-        success=True,
-        messages=messages
-    )
+        # The status line has already been sent, so report the failure in-band
+        yield orjson.dumps({
+            "success": False,
+            "messages": [],
+            "error": str(traceback.format_exc())
+        }) + b"\n"
 
-async def execute_shell_code(request: ExecuteRequest) -> ExecuteResponse:
-    """Execute shell code through Jupyter kernel"""
-    kernel = await kernel_manager.get_kernel(request.kernel_id)
-    messages = []
-    
-    # Convert bash code to Jupyter shell magic
-    code = request.code.strip()
+def shell_to_jupyter_code(code: str) -> str:
+    """Convert bash code to Jupyter shell magic"""
+    code = code.strip()
     
     # For multi-line commands, use %%bash magic
     if '\n' in code:
-        jupyter_code = f"%%bash\n{code}"
-    else:
-        # For single commands, use ! magic
-        jupyter_code = f"!{code}"
-    
-    # Execute through Jupyter kernel like Python code
-    async for message in kernel.execute_raw(jupyter_code):
-        messages.append(message)
-    
-    return ExecuteResponse(
-        success=True,
-        messages=messages
-    )
+        return f"%%bash\n{code}"
+    # For single commands, use ! magic
+    return f"!{code}"
 
 @app.delete("/kernel/{kernel_id}")
 async def shutdown_kernel(kernel_id: str):
@@ -196,12 +300,24 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.on_event("startup")
+async def startup_event():
+    """Pre-start kernels for the first requests and reap idle ones"""
+    kernel_manager.warm()
+    kernel_manager.start_reaper()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     await kernel_manager.shutdown_all()
 
 if __name__ == "__main__":
-    import os
     port = os.getenv("CONTAINER_SERVICE_PORT", "8060")
-    uvicorn.run(app, host="0.0.0.0", port=int(port), log_level="info") 
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(port),
+        log_level=LOG_LEVEL,
+        loop="uvloop",
+        http="httptools"
+    ) 
\ No newline at end of file
@@ -1,25 +1,37 @@
-from starlette.middleware import Middleware
 import asyncio
 import aiohttp
-import json
+import hashlib
+import orjson
 import os
-import subprocess
+import re
+from collections import OrderedDict
 from dotenv import load_dotenv
 import time
-from typing import List, Optional
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional
 from fastmcp import FastMCP, Context
 from fastmcp.server.middleware import Middleware as FastMCPMiddleware
 
 from .code_sandbox_types import KernelOutput, Language
 
-# env file is in the same directory as this file
-env_path = os.path.join(os.path.dirname(__file__), ".env")
-load_dotenv(env_path)
+# Directory holding the packaged .env and docker-compose.yml
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# env file is in the same directory as this file unless CODE_SANDBOX_ENV_FILE points elsewhere
+env_path = os.getenv("CODE_SANDBOX_ENV_FILE", os.path.join(PACKAGE_DIR, ".env"))
+if os.path.isfile(env_path):
+    load_dotenv(env_path, override=False)
 
 # Configuration
 CONTAINER_SERVICE_PORT = os.getenv("CONTAINER_SERVICE_PORT", "8060")
 CONTAINER_SERVICE_URL = f"http://localhost:{CONTAINER_SERVICE_PORT}"
 print(f"Container service URL: {CONTAINER_SERVICE_URL}")
+# Seconds to reuse the result of an identical execute_code call, 0 disables the cache.
+# Kernels are stateful, so only enable this for agents that repeat idempotent code.
+EXECUTE_CACHE_TTL = float(os.getenv("EXECUTE_CACHE_TTL", "0"))
+EXECUTE_CACHE_SIZE = int(os.getenv("EXECUTE_CACHE_SIZE", "128"))
+# Code that may touch the network, filesystem or installed packages is never cached
+UNCACHEABLE_CODE = re.compile(r"!pip|open\(|requests\.|http")
 
 code_sandbox_mcp = FastMCP(name="CodeSandbox")
 #mcp_logger = MCPLogger()
@@ -28,104 +40,176 @@ code_sandbox_mcp = FastMCP(name="CodeSandbox")
 # Global variables for container management
 container_process = None
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# The container Dockerfile uses BuildKit cache mounts, which docker-compose v1
+# only supports when it hands builds to the docker CLI with BuildKit enabled
+BUILDKIT_ENV = {"DOCKER_BUILDKIT": "1", "COMPOSE_DOCKER_CLI_BUILD": "1"}
+
+# Preferred output representations, checked in order
+IMAGE_MIME_TYPES = ("image/png", "image/jpeg", "image/svg+xml")
+TEXT_MIME_TYPES = ("text/markdown", "text/html", "application/json")
+
+@lru_cache(maxsize=64)
+def _select_mime_type(mime_types: frozenset) -> str:
+    """Pick the representation to return for a display_data/execute_result bundle"""
+    for mime_type in IMAGE_MIME_TYPES:
+        if mime_type in mime_types:
+            return mime_type
+    for mime_type in mime_types:
+        if "image" in mime_type:
+            return mime_type
+    for mime_type in TEXT_MIME_TYPES:
+        if mime_type in mime_types:
+            return mime_type
+    return "text/plain"
+
+def _stream_output(message: dict) -> KernelOutput:
+    return KernelOutput.model_construct(
+        mime_type="text/plain",
+        content=message["content"]["text"],
+        is_error=False
+    )
+
+def _data_output(message: dict) -> KernelOutput:
+    data = message['content']['data']
+    mime_type = _select_mime_type(frozenset(data))
+    if mime_type == "application/json":
+        content = orjson.dumps(data[mime_type]).decode()
+    else:
+        content = data[mime_type]
+    return KernelOutput.model_construct(
+        mime_type=mime_type,
+        content=content,
+        is_error=False
+    )
+
+def _error_output(message: dict) -> KernelOutput:
+    return KernelOutput.model_construct(
+        mime_type="text/plain",
+        content="\n".join(message['content']['traceback']),
+        is_error=True
+    )
+
+# Jupyter iopub msg_type -> KernelOutput builder
+MESSAGE_HANDLERS = {
+    "stream": _stream_output,
+    "display_data": _data_output,
+    "execute_result": _data_output,
+    "error": _error_output,
+}
+
 class ContainerKernelClient:
-    def __init__(self, base_url: str = CONTAINER_SERVICE_URL):
+    def __init__(
+        self,
+        base_url: str = CONTAINER_SERVICE_URL,
+        cache_ttl: float = EXECUTE_CACHE_TTL,
+        cache_size: int = EXECUTE_CACHE_SIZE
+    ):
         self.base_url = base_url
         self.session = None
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._result_cache: "OrderedDict[str, tuple[float, List[KernelOutput]]]" = OrderedDict()
     
     async def _get_session(self):
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            # One pooled, keep-alive session is shared by every request to the container
+            connector = aiohttp.TCPConnector(
+                limit=64,
+                keepalive_timeout=300,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=5)
+            )
         return self.session
     
     async def execute_code(self, kernel_id: str, code: str, language: str) -> List[KernelOutput]:
         """Execute code in the containerized service"""
+        cache_key = None
+        if self.cache_ttl > 0 and not UNCACHEABLE_CODE.search(code):
+            cache_key = hashlib.blake2b(
+                f"{kernel_id}|{language}|{code}".encode(), digest_size=16
+            ).hexdigest()
+            cached = self._result_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < self.cache_ttl:
+                self._result_cache.move_to_end(cache_key)
+                return list(cached[1])
+        
+        results = await self._execute_code(kernel_id, code, language)
+        
+        # Errors may be transient, so only successful runs are reused
+        if cache_key and not any(result.is_error for result in results):
+            self._result_cache[cache_key] = (time.monotonic(), results)
+            self._result_cache.move_to_end(cache_key)
+            while len(self._result_cache) > self.cache_size:
+                self._result_cache.popitem(last=False)
+            return list(results)
+        return results
+    
+    async def _execute_code(self, kernel_id: str, code: str, language: str) -> List[KernelOutput]:
         session = await self._get_session()
         
-        payload = {
+        # Encode the body ourselves so aiohttp's generic JSON serializer is skipped
+        payload = orjson.dumps({
             "kernel_id": kernel_id,
             "code": code,
             "language": language
-        }
+        })
         
         try:
-            async with session.post(f"{self.base_url}/execute", json=payload) as response:
+            async with session.post(
+                f"{self.base_url}/execute",
+                data=payload,
+                headers=JSON_HEADERS
+            ) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     raise Exception(f"Container service error: {error_text}")
                 
-                result = await response.json()
-                
-                if not result["success"]:
-                    raise Exception(f"Execution failed: {result.get('error', 'Unknown error')}")
-                
-                # Process the raw messages into ExecutionResult objects
-                return self._process_messages(result["messages"])
+                # Process the raw messages into KernelOutput objects as they stream in
+                return [
+                    output async for output in self._process_messages(self._iter_messages(response))
+                ]
         
         except aiohttp.ClientError as e:
             #server_logger.error(f"Failed to connect to container service: {traceback.format_exc()}")
             raise Exception(f"Failed to connect to container service: {str(e)}")
         
     
-    def _process_messages(self, messages: List[dict]) -> List[KernelOutput]:
-        """Convert raw Jupyter messages to ExecutionResult objects"""
-        results = []
-        
-        for message in messages:
-            msg_type = message.get("msg_type")
-            
-            if msg_type == 'stream':
-                results.append(KernelOutput(
-                    mime_type="text/plain",
-                    content=message["content"]["text"],
-                    is_error=False
-                ))
-            
-            elif msg_type == 'display_data' or msg_type == 'execute_result':
-                data = message['content']['data']
-                mime_types = list(data.keys())
-                if any("image" in mime_type for mime_type in mime_types):
-                    mime_type = [mt for mt in mime_types if "image" in mt][0]
-                    results.append(KernelOutput(
-                        mime_type=mime_type,
-                        content=data[mime_type],
-                        is_error=False
-                        ))
-                elif "text/markdown" in mime_types:
-                    results.append(KernelOutput(
-                        mime_type="text/markdown",
-                        content=data["text/markdown"],
-                        is_error=False
-                    ))
-                elif "text/html" in mime_types:
-                    results.append(KernelOutput(
-                        mime_type="text/html",
-                        content=data["text/html"],
-                        is_error=False
-                    ))
-                elif "application/json" in mime_types:
-                    results.append(KernelOutput(
-                        mime_type="application/json",
-                        content=json.dumps(data["application/json"]),
-                        is_error=False
-                    ))
-                else:
-                    results.append(KernelOutput(
-                        mime_type="text/plain",
-                        content=data["text/plain"],
-                        is_error=False
-                    ))
-            
-            elif msg_type == "error":
-                results.append(KernelOutput(
-                    mime_type="text/plain",
-                    content="\n".join(message['content']['traceback']),
-                    is_error=True
-                ))
-            else:
-                #log unknown message type
-                pass
-        return results
+    async def _iter_messages(self, response: aiohttp.ClientResponse) -> AsyncIterator[dict]:
+        """Parse the NDJSON execute stream into raw Jupyter messages"""
+        # Lines can hold large base64 images, so split chunks ourselves rather
+        # than relying on the stream reader's bounded readline
+        buffer = bytearray()
+        async for chunk in response.content.iter_any():
+            buffer.extend(chunk)
+            if b"\n" not in chunk:
+                continue
+            *lines, rest = buffer.split(b"\n")
+            buffer = bytearray(rest)
+            for line in lines:
+                if line:
+                    yield self._parse_message(line)
+        if buffer.strip():
+            yield self._parse_message(buffer)
+    
+    def _parse_message(self, line: bytes) -> dict:
+        message = orjson.loads(line)
+        if not message.get("success", True):
+            raise Exception(f"Execution failed: {message.get('error', 'Unknown error')}")
+        return message
+    
+    async def _process_messages(self, messages: AsyncIterator[dict]) -> AsyncIterator[KernelOutput]:
+        """Convert raw Jupyter messages to KernelOutput objects"""
+        async for message in messages:
+            # Messages without a handler (status, execute_input, ...) produce no output
+            handler = MESSAGE_HANDLERS.get(message.get("msg_type"))
+            if handler:
+                yield handler(message)
     
     async def shutdown_kernel(self, kernel_id: str):
         """Shutdown a specific kernel in the container"""
@@ -161,6 +245,18 @@ class ContainerKernelClient:
 # Global client instance
 container_client = ContainerKernelClient()
 
+async def run_docker_compose(*args: str):
+    """Run a docker-compose command without blocking the event loop"""
+    process = await asyncio.create_subprocess_exec(
+        "docker-compose", *args,
+        cwd=PACKAGE_DIR,
+        env={**os.environ, **BUILDKIT_ENV},
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process, stdout, stderr
+
 async def start_docker_container():
     """Start the Docker container using docker-compose"""
     global container_process
@@ -168,35 +264,31 @@ async def start_docker_container():
     try:
         print("Stopping any existing containers...")
         # First stop any existing containers
-        stop_process = subprocess.Popen(
-            ["docker-compose", "down"],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stop_process.communicate()
+        await run_docker_compose("down")
         
         print("Starting Docker container...")
         
-        # Start the container using docker-compose
-        container_process = subprocess.Popen(
-            ["docker-compose", "up", "-d"],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        # Start probing for readiness while docker-compose is still bringing the service up
+        health_task = asyncio.create_task(container_client.health_check())
         
-        # Wait for the process to complete
-        stdout, stderr = container_process.communicate()
+        # Start the container using docker-compose
+        container_process, stdout, stderr = await run_docker_compose("up", "-d")
         
         if container_process.returncode != 0:
+            health_task.cancel()
             raise Exception(f"Failed to start container: {stderr.decode()}")
         
         print("Docker container started successfully")
         
+        # Part of the probe's budget went on docker-compose itself (e.g. building the image),
+        # so unless it already succeeded, give the service a full timeout from here
+        if not (health_task.done() and health_task.result()):
+            health_task.cancel()
+            health_task = asyncio.create_task(container_client.health_check())
+        
         # Wait for the service to be healthy
         print("Waiting for container service to be ready...")
-        if await container_client.health_check():
+        if await health_task:
             print("Container service is healthy and ready")
         else:
             raise Exception("Container service failed to become healthy")
@@ -209,13 +301,7 @@ async def stop_docker_container():
     """Stop the Docker container"""
     try:
         print("Stopping Docker container...")
-        process = subprocess.Popen(
-            ["docker-compose", "down"],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = process.communicate()
+        process, stdout, stderr = await run_docker_compose("down")
         
         if process.returncode == 0:
             print("Docker container stopped successfully")
@@ -248,7 +334,8 @@ async def setup(middleware: Optional[List[FastMCPMiddleware]] = None):
     # Start the Docker container first
     await start_docker_container()
     
-    # Close the session so it gets recreated in the new event loop
+    # setup() runs in its own event loop before the server process starts, so
+    # close the session here and let the server's loop create its own pooled one
     await container_client.close()
     
     # Add middleware
@@ -8,16 +8,26 @@ import signal
 import time
 import multiprocessing
 
+try:
+    import uvloop
+except ImportError:  # not available on Windows
+    uvloop = None
+
 
 def run_server(server, port, path, middleware):
     """Function to run a server in a separate process"""
     print(f"🚀 Starting {server.name} server on port {port}...")
+    # FastMCP starts its own loop with anyio and ignores uvicorn's loop setting,
+    # so install uvloop through the event loop policy instead
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     try:
         server.run(
             transport="streamable-http",
             path=path,
             port=port,
             middleware=middleware,
+            uvicorn_config={"http": "httptools"},
         )
     except KeyboardInterrupt:
         pass
@@ -1,7 +1,7 @@
 from fastmcp.server.middleware import Middleware, MiddlewareContext
 from contextvars import ContextVar
-from typing import List, Optional
-from urllib.parse import parse_qs
+from typing import List, Optional, Tuple
+from urllib.parse import unquote_to_bytes
 
 # Context variable for tags
 tags_ctx: ContextVar[Optional[List[str]]] = ContextVar('tags', default=None)
@@ -9,6 +9,29 @@ tags_ctx: ContextVar[Optional[List[str]]] = ContextVar('tags', default=None)
 context_id_ctx: ContextVar[Optional[str]] = ContextVar('context_id', default=None)
 
 
+def _decode_query_value(value: bytes) -> str:
+    # Only pay for URL-decoding when the value is actually encoded
+    if b"%" in value or b"+" in value:
+        value = unquote_to_bytes(value.replace(b"+", b" "))
+    return value.decode("utf-8", "replace")
+
+
+def parse_hook_query(query_string: bytes) -> Tuple[List[str], Optional[str]]:
+    """Read the repeated `tag` and the first `context_id` parameter from a raw query string"""
+    tags = []
+    context_id = None
+    for pair in query_string.split(b"&"):
+        key, _, value = pair.partition(b"=")
+        # Blank values are ignored, as with parse_qs
+        if not value:
+            continue
+        if key == b"tag":
+            tags.append(_decode_query_value(value))
+        elif key == b"context_id" and context_id is None:
+            context_id = _decode_query_value(value)
+    return tags, context_id
+
+
 # Starlette server middleware
 class HookTagMiddleware:
     def __init__(self, app):
@@ -19,13 +42,13 @@ class HookTagMiddleware:
         if scope["type"] != "http":
             await self.app(scope, receive, send)
             return
-        query_params = parse_qs(scope["query_string"].decode("utf-8"))
-        tags = query_params.get("tag")
-        tags_ctx.set(tags if tags else [])
-        context_id = query_params.get("context_id")
-        if type(context_id) == list:
-            context_id = context_id[0]
-        context_id_ctx.set(context_id if context_id else None)
+        query_string = scope["query_string"]
+        if query_string:
+            tags, context_id = parse_hook_query(query_string)
+        else:
+            tags, context_id = [], None
+        tags_ctx.set(tags)
+        context_id_ctx.set(context_id)
         # Call the next middleware or application
         await self.app(scope, receive, send)
 
@@ -49,7 +72,6 @@ class FastMCPMiddleware(Middleware):
         if not tags_var:
             return tools
 
-        filtered_tools = [tool for tool in tools if set(tags_var) & tool.tags]
-        # also add any tools that have no tags
-        filtered_tools.extend([tool for tool in tools if not tool.tags])
-        return filtered_tools
\ No newline at end of file
+        tag_set = frozenset(tags_var)
+        # keep tools matching a requested tag, plus any tools that have no tags
+        return [tool for tool in tools if not tool.tags or tag_set & tool.tags]
\ No newline at end of file